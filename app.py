@@ -1,37 +1,352 @@
+from cachetools import TTLCache
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+import httpx
 import time
 import logging
+import logging.handlers
+import queue
 import os
 import re
+import sqlite3
+import tempfile
+import threading
+from urllib.parse import urljoin, urlparse
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeout
+from selectolax.parser import HTMLParser
+from playwright.async_api import (
+    async_playwright,
+    Error as PlaywrightError,
+    TimeoutError as PlaywrightTimeout
+)
 import asyncio
 import sys
 
-# ---------------- WINDOWS FIX ----------------
+# ---------------- EVENT LOOP ----------------
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+else:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 load_dotenv()
 
 # ---------------- LOGGING ----------------
+# Records are handed to a queue and written by a listener thread, so request
+# handlers never block on stderr. Per-step logs are DEBUG; each resolve
+# emits one INFO summary with step timings. The listener is started in the
+# lifespan, i.e. in each worker process, since threads don't survive the
+# fork of a preloading server; records queued before that are kept.
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter(
+    "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+))
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+
+# QueueHandler pre-formats the message; the listener's handler adds the rest
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
 logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[queue_handler]
 )
 logger = logging.getLogger("resolver")
 
-# ---------------- APP ----------------
-app = FastAPI(title="URL Resolver Service")
+# httpx logs every request at INFO, which would drown out the one summary
+# line per resolve.
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
 
 # ---------------- ENV ----------------
+# The resolver patterns below are built from these at import time.
+for required in ("TECH_PORTAL_DOMAIN", "CDN_DOMAIN_PATTERN"):
+    if not os.getenv(required):
+        raise RuntimeError(f"Missing required environment variable: {required}")
+
 TECH_PORTAL_DOMAIN = os.getenv("TECH_PORTAL_DOMAIN")
 CDN_DOMAIN_PATTERN = os.getenv("CDN_DOMAIN_PATTERN")
-ALLOWED_SOURCE_DOMAINS = os.getenv("ALLOWED_SOURCE_DOMAINS", "").split(",")
+ALLOWED_SOURCE_DOMAINS = frozenset(
+    domain.strip().lower()
+    for domain in os.getenv("ALLOWED_SOURCE_DOMAINS", "").split(",")
+    if domain.strip()
+)
+# Each warm context costs ~50MB of Chromium memory; size this to the container.
+CONTEXT_POOL_SIZE = int(os.getenv("CONTEXT_POOL_SIZE", "2"))
+PORTAL_CACHE_PATH = os.getenv(
+    "PORTAL_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "resolver_portal_cache.sqlite3")
+)
+
+# ---------------- PATTERNS ----------------
+PORTAL_LINK_SELECTOR = f"a[href*='{TECH_PORTAL_DOMAIN}']"
+PEPE_LINK_SELECTOR = f"a[href*='{TECH_PORTAL_DOMAIN}/?go=pepe-']"
+PORTAL_LINK_RE = re.compile(
+    rf'href=["\']([^"\']*{re.escape(TECH_PORTAL_DOMAIN)}[^"\']*)["\']',
+    re.IGNORECASE
+)
+PEPE_RE = re.compile(r'pepe-[a-f0-9]{12,}', re.IGNORECASE)
+CDN_RE = re.compile(CDN_DOMAIN_PATTERN, re.IGNORECASE)
+GOOGLE_RE = re.compile(
+    r'https://video-downloads\.googleusercontent\.com/[^\s"\']+',
+    re.IGNORECASE
+)
+
+# ---------------- HTTP ----------------
+async def start_http(app: FastAPI):
+    logger.info("STARTUP: Opening shared HTTP connection pool")
+    app.state.http_transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        # Every resolve hits the same few hosts; keep their connections warm
+        # for longer than httpx's 5s default so later requests reuse them.
+        limits=httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=20,
+            keepalive_expiry=30
+        )
+    )
+
+async def stop_http(app: FastAPI):
+    logger.info("SHUTDOWN: Closing shared HTTP connection pool")
+    await app.state.http_transport.aclose()
+
+# Hands requests to the shared pool but leaves it open when a per-resolve
+# client is closed.
+class SharedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+# Each resolve gets its own client, and with it its own cookie jar, so a
+# landing-form session never leaks into another request.
+@asynccontextmanager
+async def http_session():
+    async with httpx.AsyncClient(
+        transport=SharedTransport(app.state.http_transport),
+        timeout=15,
+        headers={"User-Agent": USER_AGENT},
+        follow_redirects=True
+    ) as http:
+        yield http
+
+# ---------------- PORTAL LINK CACHE ----------------
+# Source pages change slowly, so the portal link found on them is kept on
+# disk for an hour. Only the link is stored: the page may also embed
+# short-lived download URLs that must not outlive their expiry.
+PORTAL_CACHE_TTL = 3600
+# Workers share the file: WAL lets readers run alongside a writer, and a
+# short busy timeout means a locked database just counts as a cache miss.
+PORTAL_CACHE_BUSY_TIMEOUT = 0.5
+PORTAL_CACHE_LOCK = threading.Lock()
+
+# A cache that can't be opened (e.g. an unwritable directory) is skipped and
+# every lookup counts as a miss.
+def open_portal_cache(app: FastAPI):
+    try:
+        app.state.portal_cache = sqlite3.connect(
+            PORTAL_CACHE_PATH,
+            timeout=PORTAL_CACHE_BUSY_TIMEOUT,
+            check_same_thread=False
+        )
+    except sqlite3.Error as e:
+        logger.warning("STARTUP: Portal link cache disabled: %s", e)
+        app.state.portal_cache = None
+        return
+
+    # WAL is only a concurrency nicety; the cache works without it.
+    try:
+        app.state.portal_cache.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.Error as e:
+        logger.warning("STARTUP: Portal link cache not in WAL mode: %s", e)
+
+    try:
+        app.state.portal_cache.execute(
+            "CREATE TABLE IF NOT EXISTS portal_links "
+            "(source_url TEXT PRIMARY KEY, tech_link TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+        app.state.portal_cache.execute(
+            "DELETE FROM portal_links WHERE stored_at < ?",
+            (time.time() - PORTAL_CACHE_TTL,)
+        )
+        app.state.portal_cache.commit()
+    except sqlite3.Error as e:
+        logger.warning("STARTUP: Portal link cache not initialised: %s", e)
+
+def close_portal_cache(app: FastAPI):
+    if app.state.portal_cache is not None:
+        app.state.portal_cache.close()
+
+# Runs a cache statement on a worker thread so SQLite I/O (and any wait on
+# another worker's lock) never blocks the event loop. Cache failures are
+# logged and treated as a miss.
+def run_portal_cache(sql: str, params: tuple) -> tuple | None:
+    with PORTAL_CACHE_LOCK:
+        row = app.state.portal_cache.execute(sql, params).fetchone()
+        app.state.portal_cache.commit()
+        return row
+
+async def portal_cache(sql: str, params: tuple) -> tuple | None:
+    if app.state.portal_cache is None:
+        return None
+    try:
+        return await asyncio.to_thread(run_portal_cache, sql, params)
+    except sqlite3.Error as e:
+        logger.warning("CACHE: Portal link cache unavailable: %s", e)
+        return None
+
+async def get_cached_portal_link(source_url: str) -> str | None:
+    row = await portal_cache(
+        "SELECT tech_link FROM portal_links WHERE source_url = ? AND stored_at >= ?",
+        (source_url, time.time() - PORTAL_CACHE_TTL)
+    )
+    return row[0] if row else None
+
+async def cache_portal_link(source_url: str, tech_link: str):
+    await portal_cache(
+        "INSERT OR REPLACE INTO portal_links VALUES (?, ?, ?)",
+        (source_url, tech_link, time.time())
+    )
+
+async def evict_portal_link(source_url: str):
+    await portal_cache("DELETE FROM portal_links WHERE source_url = ?", (source_url,))
+
+# ---------------- BROWSER ----------------
+async def launch_browser(pw):
+    return await pw.chromium.launch(
+        headless=True,
+        args=[
+            "--no-sandbox",
+            "--disable-dev-shm-usage",
+            "--disable-gpu",
+            "--disable-blink-features=AutomationControlled",
+            "--blink-settings=imagesEnabled=false",
+            "--no-zygote"
+        ]
+    )
+
+async def start_browser(app: FastAPI):
+    logger.info("STARTUP: Launching shared Chromium")
+    app.state.pw = await async_playwright().start()
+    app.state.browser = await launch_browser(app.state.pw)
+
+    logger.info("STARTUP: Warming %s browser contexts", CONTEXT_POOL_SIZE)
+    app.state.context_pool = asyncio.Queue(maxsize=CONTEXT_POOL_SIZE)
+    for _ in range(CONTEXT_POOL_SIZE):
+        await app.state.context_pool.put(await new_context(app.state.browser))
+
+# Relaunches Chromium if it has crashed. The lock makes concurrent requests
+# that notice the crash wait for a single relaunch; pooled contexts from the
+# old browser are then replaced one by one as they are checked out.
+BROWSER_LOCK = asyncio.Lock()
+
+async def ensure_browser():
+    async with BROWSER_LOCK:
+        if not app.state.browser.is_connected():
+            logger.error("BROWSER: Chromium disconnected, relaunching")
+            app.state.browser = await launch_browser(app.state.pw)
+    return app.state.browser
+
+# Only markup and scripts matter for extraction; skip everything else.
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+
+async def block_heavy_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def new_context(browser):
+    context = await browser.new_context(
+        user_agent=USER_AGENT,
+        viewport={"width": 1920, "height": 1080}
+    )
+    await context.route("**/*", block_heavy_resources)
+    return context
+
+async def stop_browser(app: FastAPI):
+    logger.info("SHUTDOWN: Closing shared Chromium")
+    while not app.state.context_pool.empty():
+        await app.state.context_pool.get_nowait().close()
+    await app.state.browser.close()
+    await app.state.pw.stop()
+
+# Swaps a context that errored (crashed renderer, closed target, dead
+# browser) for a new one so the pool never shrinks. If that fails too, the old context keeps
+# the slot and the next checkout retries.
+async def recycle_context(context):
+    try:
+        await context.close()
+    except PlaywrightError:
+        pass
+    try:
+        return await new_context(await ensure_browser())
+    except PlaywrightError:
+        logger.exception("BROWSER: Could not replace broken context")
+        return context
+
+@asynccontextmanager
+async def pooled_page():
+    # Waits here when every pooled context is busy, which caps concurrency
+    context = await app.state.context_pool.get()
+    healthy = False
+    try:
+        if context.browser is not app.state.browser or not context.browser.is_connected():
+            logger.warning("BROWSER: Replacing context of a dead browser")
+            context = await recycle_context(context)
+        page = await context.new_page()
+        try:
+            yield page
+        finally:
+            # Errors raised by the caller (e.g. a failed goto) leave the context
+            # usable; only a closed/crashed page or a failing cleanup retires it.
+            try:
+                if not page.is_closed():
+                    await page.close()
+                    await context.clear_cookies()
+                    healthy = True
+            except PlaywrightError as e:
+                logger.warning("BROWSER: Context cleanup failed: %s", e)
+    finally:
+        if not healthy:
+            logger.warning("BROWSER: Replacing dead context")
+            context = await recycle_context(context)
+        await app.state.context_pool.put(context)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener.start()
+    open_portal_cache(app)
+    await start_http(app)
+    await start_browser(app)
+    try:
+        yield
+    finally:
+        await stop_browser(app)
+        await stop_http(app)
+        close_portal_cache(app)
+        log_listener.stop()
+
+# ---------------- APP ----------------
+app = FastAPI(
+    title="URL Resolver Service",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 # ---------------- SCHEMAS ----------------
 class ResolveRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     source_url: str
 
 class ResolveResponse(BaseModel):
@@ -39,156 +354,382 @@ class ResolveResponse(BaseModel):
     expires_at: int
 
 # ---------------- RESOLVER ----------------
-async def resolve_google_link(source_url: str) -> str:
-    logger.info("STEP 0: Starting Playwright async resolution")
-    logger.info(f"Source URL: {source_url}")
-
-    async with async_playwright() as p:
-        logger.info("STEP 0.1: Launching Chromium")
-
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                "--no-sandbox",
-                "--disable-dev-shm-usage",
-                "--disable-gpu",
-                "--disable-blink-features=AutomationControlled"
-            ]
-        )
+LANDING_MARKER = 'id="landing"'
 
-        context = await browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
-            viewport={"width": 1920, "height": 1080}
+# Runs the (JS-compatible) pattern inside the page until it matches and
+# returns only the matched text, so the DOM is never serialized back to
+# Python. Returns None on timeout so the caller's own extraction step can
+# report what was missing.
+async def match_in_page(page, pattern: re.Pattern, timeout: int = 15_000) -> str | None:
+    try:
+        match = await page.wait_for_function(
+            "(p) => (document.documentElement.outerHTML.match(new RegExp(p, 'i')) || [null])[0]",
+            arg=pattern.pattern,
+            timeout=timeout
         )
-
-        page = await context.new_page()
-
+    except PlaywrightTimeout:
+        return None
+    return await match.json_value()
+
+SCANNED_RESOURCE_TYPES = {"document", "xhr", "fetch"}
+
+async def render_landing(page, url: str, pattern: re.Pattern) -> str | None:
+    await page.goto(url, timeout=30_000, wait_until="domcontentloaded")
+    if await page.query_selector("#landing"):
+        async with page.expect_navigation(wait_until="domcontentloaded", timeout=30_000):
+            await page.evaluate("document.getElementById('landing').submit()")
+    return await match_in_page(page, pattern)
+
+# CSS lookup with selectolax's C parser; callers fall back to their regex
+# when the link is not a plain anchor (inline scripts, in-page matches).
+def find_href(html: str, selector: str) -> str | None:
+    node = HTMLParser(html).css_first(selector)
+    return node.attributes.get("href") if node else None
+
+# Fire-and-forget HEAD so the DNS/TLS setup for a later hop overlaps the
+# current one; the connection is then already in the client's pool.
+WARMUP_TASKS: set[asyncio.Task] = set()
+
+def warm_connection(http: httpx.AsyncClient, url: str):
+    task = asyncio.create_task(http.head(url))
+    WARMUP_TASKS.add(task)
+    task.add_done_callback(WARMUP_TASKS.discard)
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+async def fetch_html(http: httpx.AsyncClient, url: str) -> str:
+    response = await http.get(url)
+    response.raise_for_status()
+    return response.text
+
+# Scans the body chunk by chunk and stops reading at the first complete
+# match. A short tail of the previous chunk is carried over so matches
+# straddling a chunk boundary are still seen, and a match that touches the
+# end of the buffer is held back until more data shows where it ends.
+# When the whole body is read without a match, it is returned as well if it
+# is a landing page, so the form can be submitted without fetching it again.
+STREAM_OVERLAP = 256
+
+async def stream_match(
+    http: httpx.AsyncClient, url: str, pattern: re.Pattern
+) -> tuple[str | None, str | None]:
+    chunks = []
+    tail = ""
+    async with http.stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_text():
+            chunks.append(chunk)
+            window = tail + chunk
+            match = pattern.search(window)
+            if match and match.end() < len(window):
+                return match.group(0), None
+            start = match.start() if match else len(window) - STREAM_OVERLAP
+            tail = window[max(start, 0):]
+
+    match = pattern.search(tail)
+    if match:
+        return match.group(0), None
+    html = "".join(chunks)
+    return None, (html if LANDING_MARKER in html else None)
+
+# Replays the landing form as a plain HTTP request with its static fields.
+# Returns None when there is no parsable form or the site rejects the
+# submit, so the caller falls back to Chromium.
+async def post_landing_form(http: httpx.AsyncClient, url: str, html: str) -> str | None:
+    form = HTMLParser(html).css_first("form#landing")
+    if form is None:
+        return None
+
+    action = urljoin(url, form.attributes.get("action") or url)
+    data = {
+        field.attributes["name"]: field.attributes.get("value") or ""
+        for field in form.css("input")
+        if field.attributes.get("name")
+    }
+    try:
+        if (form.attributes.get("method") or "get").lower() == "post":
+            response = await http.post(action, data=data)
+        else:
+            response = await http.get(action, params=data)
+    except httpx.HTTPError as e:
+        logger.debug("HTTP: Landing form submit failed: %s", e)
+        return None
+    if not response.is_success:
+        logger.debug("HTTP: Landing form rejected with %s", response.status_code)
+        return None
+    return response.text
+
+# Landing-form pages are first submitted over HTTP; Chromium is only used
+# when that doesn't yield the pattern (fields filled in by JS, etc.).
+async def submit_landing(
+    http: httpx.AsyncClient, url: str, html: str, pattern: re.Pattern
+) -> str:
+    logger.debug("HTTP: Landing form detected, posting it directly")
+    submitted = await post_landing_form(http, url, html)
+    if submitted and pattern.search(submitted):
+        return submitted
+    return await render_landing_match(http, url, pattern)
+
+# Plain GET first; pages gated behind the landing form are submitted, and
+# only fall through to Chromium when posting the form isn't enough.
+async def load_html(http: httpx.AsyncClient, url: str, pattern: re.Pattern) -> str:
+    html = await fetch_html(http, url)
+    if LANDING_MARKER not in html:
+        return html
+    return await submit_landing(http, url, html, pattern)
+
+# Streaming variant of load_html for hops where only the match is needed.
+async def load_match(http: httpx.AsyncClient, url: str, pattern: re.Pattern) -> str:
+    match, landing_html = await stream_match(http, url, pattern)
+    if match or landing_html is None:
+        return match or ""
+    return await submit_landing(http, url, landing_html, pattern)
+
+# The browser's cookies are handed back to this resolve's HTTP client so the
+# following hops keep the session the form submit created.
+async def render_landing_match(http: httpx.AsyncClient, url: str, pattern: re.Pattern) -> str:
+    logger.debug("BROWSER: Submitting landing form in Chromium")
+    async with pooled_page() as page:
+        # Response bodies are scanned as they arrive, so a match on the wire
+        # wins over waiting for the navigation and DOM to settle.
+        found = asyncio.get_running_loop().create_future()
+
+        async def scan_response(response):
+            if found.done() or response.request.resource_type not in SCANNED_RESOURCE_TYPES:
+                return
+            try:
+                body = await response.text()
+            except PlaywrightError:
+                return
+            match = pattern.search(body)
+            if match and not found.done():
+                found.set_result(match.group(0))
+
+        page.on("response", scan_response)
+        rendered = asyncio.ensure_future(render_landing(page, url, pattern))
         try:
-            # 1️⃣ Open source page
-            logger.info("STEP 1: Opening source page")
-            await page.goto(source_url, timeout=30_000, wait_until="domcontentloaded")
-            await page.wait_for_timeout(2000)
+            await asyncio.wait({found, rendered}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            rendered.cancel()
+            # Let it unwind before the page closes, and retrieve any error it
+            # raised while losing the race
+            await asyncio.gather(rendered, return_exceptions=True)
 
-            # 2️⃣ Find portal link
-            logger.info("STEP 2: Searching for portal link")
-            anchors = await page.query_selector_all("a[href]")
+        match = found.result() if found.done() else rendered.result() or ""
 
-            tech_link = None
-            for a in anchors:
-                href = await a.get_attribute("href")
-                if href and TECH_PORTAL_DOMAIN in href:
-                    tech_link = href
-                    break
+        for cookie in await page.context.cookies():
+            http.cookies.set(
+                cookie["name"], cookie["value"],
+                domain=cookie["domain"], path=cookie["path"]
+            )
 
-            if not tech_link:
-                logger.error("STEP 2 FAILED: Portal link not found")
-                raise ValueError("No portal link found")
+    return match
 
-            logger.info(f"STEP 2 SUCCESS: Found portal link → {tech_link}")
-
-            # 3️⃣ Open portal
-            logger.info("STEP 3: Opening portal page")
-            await page.goto(tech_link, timeout=30_000, wait_until="domcontentloaded")
-            await page.wait_for_timeout(3000)
-
-            # 4️⃣ Handle form auto-submit
-            logger.info("STEP 4: Checking for landing form")
-            landing = await page.query_selector("#landing")
-            if landing:
-                logger.info("STEP 4: Submitting landing form")
-                await page.evaluate("document.getElementById('landing').submit()")
-                await page.wait_for_timeout(3000)
-            else:
-                logger.info("STEP 4: No landing form found")
-
-            # 5️⃣ Extract token
-            logger.info("STEP 5: Extracting access token")
-            html = await page.content()
-
-            pepe_match = re.search(r'pepe-[a-f0-9]{12,}', html, re.IGNORECASE)
-            if not pepe_match:
-                logger.error("STEP 5 FAILED: No access token found")
-                raise ValueError("No access token found")
-
-            pepe_token = pepe_match.group(0)
-            logger.info(f"STEP 5 SUCCESS: Token → {pepe_token[:20]}...")
-
-            # 6️⃣ Follow token URL
-            pepe_url = f"https://{TECH_PORTAL_DOMAIN}/?go={pepe_token}"
-            logger.info(f"STEP 6: Opening token URL → {pepe_url}")
-
-            await page.goto(pepe_url, timeout=30_000, wait_until="domcontentloaded")
-            await page.wait_for_timeout(3000)
-
-            # 7️⃣ Extract CDN link
-            logger.info("STEP 7: Extracting CDN link")
-            html = await page.content()
-
-            cdn_match = re.search(CDN_DOMAIN_PATTERN, html, re.IGNORECASE)
-            if not cdn_match:
-                logger.error("STEP 7 FAILED: CDN link not found")
-                raise ValueError("No distribution link found")
-
-            cdn_url = f"https://{cdn_match.group(0)}"
-            logger.info(f"STEP 7 SUCCESS: CDN URL → {cdn_url}")
-
-            # 8️⃣ Open CDN page
-            logger.info("STEP 8: Opening CDN page")
-            await page.goto(cdn_url, timeout=30_000, wait_until="domcontentloaded")
-            await page.wait_for_timeout(3000)
-
-            # 9️⃣ Extract Google download link
-            logger.info("STEP 9: Extracting Google download link")
-            html = await page.content()
-
-            google_match = re.search(
-                r'(https://video-downloads\.googleusercontent\.com/[^\s"\']+)',
-                html,
-                re.IGNORECASE
+# Fallback for source pages that inject the portal link with JS.
+async def render_portal_link(source_url: str) -> str | None:
+    logger.debug("BROWSER: Portal link not in static HTML, rendering source page")
+    async with pooled_page() as page:
+        await page.goto(source_url, timeout=30_000, wait_until="domcontentloaded")
+        # One in-page lookup that polls until the link exists and returns it
+        try:
+            portal_href = await page.wait_for_function(
+                "(domain) => [...document.querySelectorAll('a[href]')]"
+                ".map(a => a.href).find(h => h.includes(domain))",
+                arg=TECH_PORTAL_DOMAIN,
+                timeout=10_000
             )
+        except PlaywrightTimeout:
+            return None
+        return await portal_href.json_value()
 
-            if not google_match:
-                logger.error("STEP 9 FAILED: Google download link not found")
-                raise ValueError("No Google download link found")
+async def resolve_google_link(
+    http: httpx.AsyncClient, source_url: str, use_cache: bool = True
+) -> str:
+    logger.debug("STEP 0: Starting resolution for %s", source_url)
 
-            final_url = google_match.group(1)
-            logger.info(f"STEP 9 SUCCESS: Final URL extracted (len={len(final_url)})")
+    timings = {}
+    started = lap_started = time.perf_counter()
 
-            return final_url
+    def lap(step: str):
+        nonlocal lap_started
+        now = time.perf_counter()
+        timings[step] = now - lap_started
+        lap_started = now
 
-        except PlaywrightTimeout:
-            logger.error("TIMEOUT: Playwright navigation timed out")
-            raise
+    outcome = "FAILED"
+    from_cache = False
+    try:
+        tech_link = await get_cached_portal_link(source_url) if use_cache else None
+        from_cache = bool(tech_link)
+        if from_cache:
+            logger.debug("STEP 1-2 CACHED: Portal link → %s", tech_link)
+        else:
+            # 1️⃣ Fetch source page
+            logger.debug("STEP 1: Fetching source page")
+            warm_connection(http, f"https://{TECH_PORTAL_DOMAIN}/")
+            html = await fetch_html(http, source_url)
+            lap("source")
+
+            # Some posts embed the download link directly; skip the chain
+            google_match = GOOGLE_RE.search(html)
+            if google_match:
+                final_url = google_match.group(0)
+                logger.debug("STEP 1 SHORTCUT: Final URL on source page (len=%s)", len(final_url))
+                outcome = "SHORTCUT"
+                return final_url
 
-        except Exception as e:
-            logger.exception(f"RESOLUTION ERROR: {e}")
-            raise
+            # 2️⃣ Find portal link
+            logger.debug("STEP 2: Searching for portal link")
+            tech_link = find_href(html, PORTAL_LINK_SELECTOR)
+            if not tech_link:
+                portal_match = PORTAL_LINK_RE.search(html)
+                if portal_match:
+                    tech_link = portal_match.group(1)
+                else:
+                    tech_link = await render_portal_link(source_url)
 
-        finally:
-            logger.info("CLEANUP: Closing browser")
-            await context.close()
-            await browser.close()
+            if not tech_link:
+                logger.error("STEP 2 FAILED: Portal link not found")
+                raise ValueError("No portal link found")
+
+            logger.debug("STEP 2 SUCCESS: Found portal link → %s", tech_link)
+            await cache_portal_link(source_url, tech_link)
+            lap("portal_link")
+
+        # 3️⃣ + 4️⃣ Open portal, submitting the landing form if present
+        logger.debug("STEP 3: Opening portal page")
+        html = await load_html(http, tech_link, PEPE_RE)
+        lap("portal")
+
+        # 5️⃣ Extract token
+        logger.debug("STEP 5: Extracting access token")
+        pepe_match = PEPE_RE.search(find_href(html, PEPE_LINK_SELECTOR) or html)
+        if not pepe_match:
+            logger.error("STEP 5 FAILED: No access token found")
+            raise ValueError("No access token found")
+
+        pepe_token = pepe_match.group(0)
+        logger.debug("STEP 5 SUCCESS: Token → %s...", pepe_token[:20])
+
+        # 6️⃣ Follow token URL
+        pepe_url = f"https://{TECH_PORTAL_DOMAIN}/?go={pepe_token}"
+        logger.debug("STEP 6: Opening token URL → %s", pepe_url)
+        html = await load_match(http, pepe_url, CDN_RE)
+        lap("token_page")
+
+        # 7️⃣ Extract CDN link
+        logger.debug("STEP 7: Extracting CDN link")
+        cdn_match = CDN_RE.search(html)
+        if not cdn_match:
+            logger.error("STEP 7 FAILED: CDN link not found")
+            raise ValueError("No distribution link found")
+
+        cdn_url = f"https://{cdn_match.group(0)}"
+        logger.debug("STEP 7 SUCCESS: CDN URL → %s", cdn_url)
+
+        # 8️⃣ Open CDN page
+        logger.debug("STEP 8: Opening CDN page")
+        html = await load_match(http, cdn_url, GOOGLE_RE)
+        lap("cdn_page")
+
+        # 9️⃣ Extract Google download link
+        logger.debug("STEP 9: Extracting Google download link")
+        google_match = GOOGLE_RE.search(html)
+
+        if not google_match:
+            logger.error("STEP 9 FAILED: Google download link not found")
+            raise ValueError("No Google download link found")
+
+        final_url = google_match.group(0)
+        logger.debug("STEP 9 SUCCESS: Final URL extracted (len=%s)", len(final_url))
+
+        outcome = "RESOLVED"
+        return final_url
+
+    except Exception as e:
+        if isinstance(e, PlaywrightTimeout):
+            logger.error("TIMEOUT: Playwright navigation timed out")
+        elif isinstance(e, httpx.TimeoutException):
+            logger.error("TIMEOUT: HTTP request timed out")
+        else:
+            logger.exception("RESOLUTION ERROR: %s", e)
+        if not from_cache:
+            raise
+        outcome = "STALE PORTAL LINK"
+
+    finally:
+        if logger.isEnabledFor(logging.INFO):
+            steps = " ".join(f"{step}={seconds:.2f}s" for step, seconds in timings.items())
+            logger.info("%s in %.2fs | %s", outcome, time.perf_counter() - started, steps)
+
+    # Only reached when a chain built on a cached portal link failed: the link
+    # may have rotated, so drop it and retry once from the source page.
+    logger.warning("CACHE: Evicting cached portal link and retrying from source page")
+    await evict_portal_link(source_url)
+    return await resolve_google_link(http, source_url, use_cache=False)
+
+# ---------------- CACHE ----------------
+# Google links are handed out with a 300s expiry; keep them for less than
+# that so a cached answer always has a useful lifetime left.
+URL_TTL = 300
+RESULT_CACHE = TTLCache(maxsize=1024, ttl=240)
+
+# Single-flight: concurrent misses for the same source URL share one
+# resolution instead of each driving its own chain.
+INFLIGHT: dict[str, asyncio.Future] = {}
+
+async def resolve_and_cache(source_url: str) -> dict:
+    try:
+        async with http_session() as http:
+            url = await resolve_google_link(http, source_url)
+        result = {"direct_download_url": url, "expires_at": int(time.time()) + URL_TTL}
+        RESULT_CACHE[source_url] = result
+        return result
+    finally:
+        INFLIGHT.pop(source_url, None)
 
 # ---------------- API ----------------
+# Matches the URL's host (or a subdomain of it) rather than any substring,
+# so e.g. https://evil.example/?allowed.com is rejected. Non-web schemes and
+# URLs urlparse can't split (e.g. an unclosed IPv6 bracket) are rejected too.
+def is_allowed_source(source_url: str) -> bool:
+    try:
+        parsed = urlparse(source_url)
+        host = parsed.hostname or ""
+    except ValueError:
+        return False
+    if parsed.scheme not in ("http", "https"):
+        return False
+    return any(host == domain or host.endswith("." + domain) for domain in ALLOWED_SOURCE_DOMAINS)
+
 @app.post("/resolve", response_model=ResolveResponse)
 async def resolve_url(payload: ResolveRequest):
     source_url = payload.source_url
 
-    logger.info("API CALL: /resolve")
+    logger.debug("API CALL: /resolve")
 
     if not source_url:
         raise HTTPException(status_code=400, detail="source_url is required")
 
-    if not any(domain in source_url for domain in ALLOWED_SOURCE_DOMAINS):
+    if not is_allowed_source(source_url):
         logger.warning("Blocked source domain")
         raise HTTPException(status_code=400, detail="Invalid source URL")
 
+    hit = RESULT_CACHE.get(source_url)
+    if hit and hit["expires_at"] > time.time() + 10:
+        logger.debug("CACHE HIT: Returning cached download URL")
+        return ResolveResponse(**hit)
+
+    inflight = INFLIGHT.get(source_url)
+    if inflight is None:
+        inflight = asyncio.create_task(resolve_and_cache(source_url))
+        INFLIGHT[source_url] = inflight
+    else:
+        logger.debug("IN FLIGHT: Joining running resolution")
+
     try:
-        url = await resolve_google_link(source_url)
-        return ResolveResponse(
-            direct_download_url=url,
-            expires_at=int(time.time()) + 300
-        )
+        # Shielded so one client disconnecting doesn't cancel it for the rest
+        result = await asyncio.shield(inflight)
+        return ResolveResponse(**result)
 
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to resolve source URL")
@@ -196,12 +737,18 @@ async def resolve_url(payload: ResolveRequest):
 # ---------------- HEALTH ----------------
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "timestamp": int(time.time())}
+    # A crashed Chromium is relaunched by the next resolve that needs it
+    browser = app.state.browser.is_connected()
+    return {
+        "status": "healthy" if browser else "degraded",
+        "browser": "connected" if browser else "disconnected",
+        "timestamp": int(time.time())
+    }
 
 @app.get("/")
 async def root():
     return {
         "service": "URL Resolver Service",
         "engine": "playwright-async",
-        "logging": "step-by-step"
+        "logging": "step-timings"
     }
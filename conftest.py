@@ -0,0 +1,6 @@
+import os
+
+# app.py builds its patterns from these at import time
+os.environ.setdefault("TECH_PORTAL_DOMAIN", "tech.example.com")
+os.environ.setdefault("CDN_DOMAIN_PATTERN", r"cdn\.example\.com/file/[a-z0-9]+")
+os.environ["ALLOWED_SOURCE_DOMAINS"] = "blog.example.org"
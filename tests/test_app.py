@@ -0,0 +1,22 @@
+import pytest
+
+from app import is_allowed_source
+
+
+@pytest.mark.parametrize("source_url", [
+    "https://blog.example.org/post/1",
+    "https://www.blog.example.org/post/1",
+])
+def test_allowed_source(source_url):
+    assert is_allowed_source(source_url)
+
+
+@pytest.mark.parametrize("source_url", [
+    "https://evil.com/?blog.example.org",
+    "https://evilblog.example.org/post/1",
+    "https://[blog.example.org/post/1",
+    "http://blog.example.org]/",
+    "ftp://blog.example.org/post/1",
+])
+def test_rejected_source(source_url):
+    assert not is_allowed_source(source_url)